@@ -3,54 +3,127 @@
 import os
 import json
 import logging
-from flask import Flask, jsonify, request
+from functools import lru_cache
+from urllib.parse import urlparse
+import grpc
+import orjson
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import itertools
 import time
+from time import perf_counter
 import random
 
 # OpenTelemetry imports
 from opentelemetry import trace, metrics
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter, Compression
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
 from opentelemetry.sdk.resources import Resource
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
 logger = logging.getLogger(__name__)
 
+# Artificial handler latency for demos; off unless SIMULATE_LATENCY=1
+_SIMULATE = os.environ.get("SIMULATE_LATENCY") == "1"
+
+def _latency_table(low, high, size=1024):
+    """Cycle through pre-generated sleep durations in [low, high]"""
+    return itertools.cycle([random.uniform(low, high) for _ in range(size)])
+
+_LIST_SLEEPS = _latency_table(0.01, 0.05)
+_GET_SLEEPS = _latency_table(0.005, 0.02)
+_SEARCH_SLEEPS = _latency_table(0.02, 0.08)
+
+# JSON provider backed by orjson for faster response encoding
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+# Keepalive options for the gRPC channel to the collector
+_GRPC_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 10000),
+    ("grpc.keepalive_timeout_ms", 5000),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+@lru_cache(maxsize=None)
+def otlp_channel(endpoint, compression):
+    """Return one shared insecure gRPC channel per collector endpoint"""
+    target = urlparse(endpoint).netloc or endpoint
+    return grpc.insecure_channel(target, options=_GRPC_CHANNEL_OPTIONS, compression=compression)
+
+def use_channel(exporter, channel):
+    """Point an OTLP gRPC exporter at an existing channel"""
+    exporter._client = exporter._stub(channel)
+    return exporter
+
 # Configure OpenTelemetry
 def configure_opentelemetry():
     # Create resource with service information
     resource = Resource.create({
         "service.name": "productcatalog",
         "service.version": "1.0.0",
-        "service.instance.id": os.environ.get("HOSTNAME", "unknown"),
+        # Each gunicorn worker exports its own cumulative metrics, so the pid
+        # keeps their series distinct within a pod
+        "service.instance.id": f"{os.environ.get('HOSTNAME', 'unknown')}-{os.getpid()}",
     })
     
-    # Configure tracing
-    trace_provider = TracerProvider(resource=resource)
+    # gzip OTLP payloads by default; OTEL_EXPORTER_OTLP_COMPRESSION=none disables it
+    compression = {
+        "gzip": Compression.Gzip,
+        "deflate": Compression.Deflate,
+        "none": Compression.NoCompression,
+    }.get(os.environ.get("OTEL_EXPORTER_OTLP_COMPRESSION", "gzip").lower(), Compression.Gzip)
+    
+    # Configure tracing. Unless OTEL_TRACES_SAMPLER picks a sampler, sample a
+    # fraction of new traces and follow the parent's decision otherwise
+    sampler = None
+    if "OTEL_TRACES_SAMPLER" not in os.environ:
+        sample_rate = float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", "0.05"))
+        sampler = ParentBased(TraceIdRatioBased(sample_rate))
+    trace_provider = TracerProvider(resource=resource, sampler=sampler)
     trace.set_tracer_provider(trace_provider)
     
     # Configure OTLP exporter for traces
-    otlp_exporter = OTLPSpanExporter(
-        endpoint=os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://otel-collector:4317"),
-        insecure=True
+    traces_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://otel-collector:4317")
+    otlp_exporter = use_channel(
+        OTLPSpanExporter(endpoint=traces_endpoint, insecure=True, compression=compression),
+        otlp_channel(traces_endpoint, compression),
     )
     
-    span_processor = BatchSpanProcessor(otlp_exporter)
+    # Batch tuned for bursty traffic; override via the standard OTEL_BSP_* vars.
+    # A batch of 1/16 of the queue makes exports fire as soon as a batch fills
+    # rather than waiting on the schedule: more gRPC calls, lower span latency.
+    span_processor = BatchSpanProcessor(
+        otlp_exporter,
+        max_queue_size=int(os.environ.get("OTEL_BSP_MAX_QUEUE_SIZE", 8192)),
+        schedule_delay_millis=int(os.environ.get("OTEL_BSP_SCHEDULE_DELAY", 500)),
+        max_export_batch_size=int(os.environ.get("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", 512)),
+        export_timeout_millis=int(os.environ.get("OTEL_BSP_EXPORT_TIMEOUT", 10000)),
+    )
     trace_provider.add_span_processor(span_processor)
     
-    # Configure metrics
+    # Configure metrics, sharing the trace channel when endpoints match
+    metrics_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_METRICS_ENDPOINT", "http://otel-collector:4317")
     metric_reader = PeriodicExportingMetricReader(
-        OTLPMetricExporter(
-            endpoint=os.environ.get("OTEL_EXPORTER_OTLP_METRICS_ENDPOINT", "http://otel-collector:4317"),
-            insecure=True
+        use_channel(
+            OTLPMetricExporter(endpoint=metrics_endpoint, insecure=True, compression=compression),
+            otlp_channel(metrics_endpoint, compression),
         ),
         export_interval_millis=5000,
     )
@@ -65,11 +138,13 @@ tracer, meter = configure_opentelemetry()
 
 # Create Flask app
 app = Flask(__name__)
-CORS(app)
+app.url_map.strict_slashes = False
+app.json = OrjsonProvider(app)
+# Wildcard GET-only CORS avoids per-request origin matching
+CORS(app, origins="*", methods=["GET"], send_wildcard=True, automatic_options=False)
 
-# Auto-instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Auto-instrument Flask; health probes are not traced
+FlaskInstrumentor().instrument_app(app, excluded_urls=r"^https?://[^/]+/health/?$")
 
 # Create custom metrics
 request_counter = meter.create_counter(
@@ -84,6 +159,17 @@ request_duration = meter.create_histogram(
     unit="s"
 )
 
+# Pre-bound instrument methods for the request handlers
+_start_span = tracer.start_as_current_span
+_counter_add = request_counter.add
+_hist_record = request_duration.record
+
+# Metric attributes, shared across requests (the SDK treats them as read-only)
+_ATTR_LIST = {"endpoint": "/products", "method": "GET"}
+_ATTR_GET_FOUND = {"endpoint": "/products/{id}", "method": "GET", "status": "found"}
+_ATTR_GET_NF = {"endpoint": "/products/{id}", "method": "GET", "status": "not_found"}
+_ATTR_SEARCH = {"endpoint": "/products/search", "method": "GET"}
+
 # Sample product data
 PRODUCTS = [
     {
@@ -128,111 +214,128 @@ PRODUCTS = [
     }
 ]
 
-@app.route('/health')
+# Index products by ID for constant-time lookups
+PRODUCTS_BY_ID = {p["id"]: p for p in PRODUCTS}
+
+# Pre-lowercased searchable text per product; NUL separators keep a query
+# from matching across field boundaries
+_SEARCH_INDEX = [
+    (p, "\0".join([p["name"], p["description"], *p["categories"]]).lower())
+    for p in PRODUCTS
+]
+
+# Static responses are serialized once at startup
+_HEALTH_JSON = json.dumps({"status": "healthy", "service": "productcatalog"}).encode()
+_PRODUCTS_JSON = json.dumps({"products": PRODUCTS}).encode()
+_SEARCH_ALL_JSON = json.dumps({"query": "", "products": PRODUCTS, "total": len(PRODUCTS)}).encode()
+PRODUCTS_JSON_BY_ID = {p["id"]: json.dumps(p).encode() for p in PRODUCTS}
+
+@app.route('/health', provide_automatic_options=False)
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "productcatalog"})
+    return Response(_HEALTH_JSON, mimetype='application/json')
 
-@app.route('/products')
+@app.route('/products', provide_automatic_options=False)
 def list_products():
     """List all products"""
-    start_time = time.time()
+    start_time = perf_counter()
     
-    with tracer.start_as_current_span("list_products") as span:
+    with _start_span("list_products") as span:
         span.set_attribute("product.count", len(PRODUCTS))
         
         # Simulate some processing time
-        time.sleep(random.uniform(0.01, 0.05))
+        if _SIMULATE:
+            time.sleep(next(_LIST_SLEEPS))
         
         # Add custom attributes
         span.set_attribute("http.method", request.method)
         span.set_attribute("http.url", request.url)
         
         # Record metrics
-        request_counter.add(1, {"endpoint": "/products", "method": "GET"})
+        _counter_add(1, _ATTR_LIST)
         
-        duration = time.time() - start_time
-        request_duration.record(duration, {"endpoint": "/products", "method": "GET"})
+        duration = perf_counter() - start_time
+        _hist_record(duration, _ATTR_LIST)
         
-        logger.info(f"Listed {len(PRODUCTS)} products")
+        logger.info("Listed %d products", len(PRODUCTS))
         
-        return jsonify({"products": PRODUCTS})
+        return Response(_PRODUCTS_JSON, mimetype='application/json')
 
-@app.route('/products/<product_id>')
+@app.route('/products/<product_id>', provide_automatic_options=False)
 def get_product(product_id):
     """Get a specific product by ID"""
-    start_time = time.time()
+    start_time = perf_counter()
     
-    with tracer.start_as_current_span("get_product") as span:
+    with _start_span("get_product") as span:
         span.set_attribute("product.id", product_id)
         span.set_attribute("http.method", request.method)
         span.set_attribute("http.url", request.url)
         
         # Simulate database lookup time
-        time.sleep(random.uniform(0.005, 0.02))
+        if _SIMULATE:
+            time.sleep(next(_GET_SLEEPS))
         
         # Find product
-        product = next((p for p in PRODUCTS if p["id"] == product_id), None)
+        product = PRODUCTS_BY_ID.get(product_id)
         
         if product:
             span.set_attribute("product.found", True)
             span.set_attribute("product.name", product["name"])
             
             # Record metrics
-            request_counter.add(1, {"endpoint": "/products/{id}", "method": "GET", "status": "found"})
+            _counter_add(1, _ATTR_GET_FOUND)
             
-            duration = time.time() - start_time
-            request_duration.record(duration, {"endpoint": "/products/{id}", "method": "GET", "status": "found"})
+            duration = perf_counter() - start_time
+            _hist_record(duration, _ATTR_GET_FOUND)
             
-            logger.info(f"Found product: {product['name']}")
-            return jsonify(product)
+            logger.info("Found product: %s", product["name"])
+            return Response(PRODUCTS_JSON_BY_ID[product_id], mimetype='application/json')
         else:
             span.set_attribute("product.found", False)
             span.set_attribute("error", True)
             
             # Record metrics
-            request_counter.add(1, {"endpoint": "/products/{id}", "method": "GET", "status": "not_found"})
+            _counter_add(1, _ATTR_GET_NF)
             
-            duration = time.time() - start_time
-            request_duration.record(duration, {"endpoint": "/products/{id}", "method": "GET", "status": "not_found"})
+            duration = perf_counter() - start_time
+            _hist_record(duration, _ATTR_GET_NF)
             
-            logger.warning(f"Product not found: {product_id}")
+            logger.warning("Product not found: %s", product_id)
             return jsonify({"error": "Product not found"}), 404
 
-@app.route('/products/search')
+@app.route('/products/search', provide_automatic_options=False)
 def search_products():
     """Search products by query"""
-    start_time = time.time()
+    start_time = perf_counter()
     query = request.args.get('q', '').lower()
     
-    with tracer.start_as_current_span("search_products") as span:
+    # An empty query matches everything; skip the span and filtering
+    if not query:
+        _counter_add(1, _ATTR_SEARCH)
+        _hist_record(perf_counter() - start_time, _ATTR_SEARCH)
+        return Response(_SEARCH_ALL_JSON, mimetype='application/json')
+    
+    with _start_span("search_products") as span:
         span.set_attribute("search.query", query)
         span.set_attribute("http.method", request.method)
         span.set_attribute("http.url", request.url)
         
         # Simulate search processing time
-        time.sleep(random.uniform(0.02, 0.08))
+        if _SIMULATE:
+            time.sleep(next(_SEARCH_SLEEPS))
         
         # Filter products based on query
-        if query:
-            filtered_products = [
-                p for p in PRODUCTS 
-                if query in p["name"].lower() or 
-                   query in p["description"].lower() or
-                   any(query in cat.lower() for cat in p["categories"])
-            ]
-        else:
-            filtered_products = PRODUCTS
+        filtered_products = [p for p, haystack in _SEARCH_INDEX if query in haystack]
         
         span.set_attribute("search.results_count", len(filtered_products))
         
         # Record metrics
-        request_counter.add(1, {"endpoint": "/products/search", "method": "GET"})
+        _counter_add(1, _ATTR_SEARCH)
         
-        duration = time.time() - start_time
-        request_duration.record(duration, {"endpoint": "/products/search", "method": "GET"})
+        duration = perf_counter() - start_time
+        _hist_record(duration, _ATTR_SEARCH)
         
-        logger.info(f"Search for '{query}' returned {len(filtered_products)} results")
+        logger.info("Search for '%s' returned %d results", query, len(filtered_products))
         
         return jsonify({
             "query": query,
@@ -240,8 +343,9 @@ def search_products():
             "total": len(filtered_products)
         })
 
-if __name__ == '__main__':
+# Production traffic is served by gunicorn (see gunicorn_conf.py)
+if __name__ == '__main__' and os.environ.get("USE_DEV_SERVER"):
     port = int(os.environ.get('PORT', 7000))
-    logger.info(f"Starting Product Catalog Service on port {port}")
+    logger.info("Starting Product Catalog Service on port %d", port)
     app.run(host='0.0.0.0', port=port, debug=False)
 
@@ -0,0 +1,10 @@
+import os
+
+# Gunicorn configuration for the Product Catalog Service.
+# Worker count is fixed rather than derived from cpu_count(), which reports
+# the node's CPUs instead of the pod's limit.
+bind = f"0.0.0.0:{os.environ.get('PORT', 7000)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_class = "gthread"
+keepalive = 30